@@ -1,19 +1,190 @@
 #!/usr/bin/env python3
 import os
+import argparse
 import torch
+import torch.nn.functional as F
 from pathlib import Path
 import torchaudio
 import numpy as np
+import soundfile
 from demucs.pretrained import get_model
-from demucs.apply import apply_model
+from demucs.apply import BagOfModels
+from demucs.utils import center_trim
 
-def extract_vocals(input_file, output_dir="extracted_vocals"):
+# Loaded Demucs models, keyed by (name, device, fp16, compile), reused across calls
+_MODEL_CACHE = {}
+
+def _compile_model(model):
+    """
+    Compile a Demucs model (or each model in a bag) with torch.compile.
+    Falls back to the eager model on PyTorch versions without torch.compile.
+    """
+    try:
+        if isinstance(model, BagOfModels):
+            # A bag can't be called directly, so compile the models it wraps
+            for i, sub_model in enumerate(model.models):
+                model.models[i] = torch.compile(sub_model, mode="reduce-overhead", fullgraph=False)
+            return model
+        return torch.compile(model, mode="reduce-overhead", fullgraph=False)
+    except Exception as e:
+        print(f"(torch.compile unavailable, running eagerly: {e})")
+        return model
+
+def _get_model(name, device, fp16=False, compile_model=False):
+    """
+    Load a pretrained Demucs model onto the device once per process and
+    return the cached copy on subsequent calls.
+    """
+    key = (name, device, fp16, compile_model)
+    if key not in _MODEL_CACHE:
+        print(f"Loading Demucs model '{name}'...")
+        model = get_model(name)
+        model.eval()
+        model = model.to(device)
+        if fp16:
+            model = model.half()
+        if device == "cuda":
+            # Segment shapes are fixed, so let cuDNN pick the fastest conv algorithms once
+            torch.backends.cudnn.benchmark = True
+        if compile_model:
+            model = _compile_model(model)
+        _MODEL_CACHE[key] = model
+    return _MODEL_CACHE[key]
+
+def cuda_graph_forward(model, example_batch, batch_size, warmup_iters=3):
+    """
+    Capture the model's forward pass on a fixed-shape batch into a CUDA graph.
+
+    Args:
+        model (torch.nn.Module): The model to capture
+        example_batch (torch.Tensor): A batch with the per-item shape, dtype and device to capture
+        batch_size (int): Fixed batch size of the captured graph
+
+    Returns:
+        callable: forward(batch) that replays the graph. Partial batches are
+                  zero-padded up to batch_size. The returned tensor is only
+                  valid until the next call.
+    """
+    static_input = torch.zeros((batch_size,) + tuple(example_batch.shape[1:]),
+                               dtype=example_batch.dtype, device=example_batch.device)
+
+    # Warm up on a side stream so lazy initialization isn't recorded in the graph
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        for _ in range(warmup_iters):
+            model(static_input)
+    torch.cuda.current_stream().wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph):
+        static_output = model(static_input)
+
+    def forward(batch):
+        num_items = batch.shape[0]
+        static_input[:num_items].copy_(batch)
+        static_input[num_items:].zero_()
+        graph.replay()
+        return static_output[:num_items]
+
+    return forward
+
+def separate_segments(model, mix, batch_size=4, overlap=0.25, use_cuda_graph=False, source_indices=None):
+    """
+    Run a single Demucs model over overlapping segments of the mixture,
+    `batch_size` segments per forward pass, and overlap-add the results.
+
+    Args:
+        model (torch.nn.Module): A single (non-bag) Demucs model
+        mix (torch.Tensor): Mixture of shape (channels, time), on the model's device
+        batch_size (int): Number of segments per forward pass
+        overlap (float): Fraction of overlap between consecutive segments
+        use_cuda_graph (bool): Replay the forward pass from a captured CUDA graph
+        source_indices (list): Indices of the sources to keep (default: all). The
+                               other stems are dropped right after each forward pass.
+
+    Returns:
+        torch.Tensor: Separated sources of shape (kept sources, channels, time)
+    """
+    if source_indices is None:
+        source_indices = list(range(len(model.sources)))
+    channels, length = mix.shape
+    segment = int(model.segment * model.samplerate)
+    stride = int((1 - overlap) * segment)
+    valid_length = model.valid_length(segment) if hasattr(model, "valid_length") else segment
+
+    # Triangular weighting for the overlap-add, same as demucs.apply
+    weight = torch.cat([torch.arange(1, segment // 2 + 1),
+                        torch.arange(segment - segment // 2, 0, -1)]).to(mix.device, torch.float32)
+    weight = weight / weight.max()
+
+    # Pad the end so the last segment is complete, then view as (num_segments, channels, segment)
+    num_segments = max(1, -(-(length - segment) // stride) + 1)
+    padded_length = (num_segments - 1) * stride + segment
+    mix = F.pad(mix, (0, padded_length - length))
+    chunks = mix.unfold(-1, segment, stride).transpose(0, 1)
+
+    out = torch.zeros(len(source_indices), channels, padded_length, device=mix.device)
+    sum_weight = torch.zeros(padded_length, device=mix.device)
+    forward = model
+    for start in range(0, num_segments, batch_size):
+        batch = chunks[start:start + batch_size].contiguous()
+        if valid_length != segment:
+            delta = valid_length - segment
+            batch = F.pad(batch, (delta // 2, delta - delta // 2))
+        # Every batch has the same shape, so one captured graph serves them all
+        if use_cuda_graph and forward is model:
+            forward = cuda_graph_forward(model, batch, batch_size)
+        # Keep only the requested stems so the others are freed and skip the overlap-add
+        estimates = center_trim(forward(batch)[:, source_indices], segment)
+        for i, estimate in enumerate(estimates):
+            offset = (start + i) * stride
+            out[..., offset:offset + segment] += weight * estimate.float()
+            sum_weight[offset:offset + segment] += weight
+
+    out /= sum_weight
+    return out[..., :length]
+
+def separate_batched(model, mix, batch_size=4, overlap=0.25, use_cuda_graph=False, source_indices=None):
+    """
+    Batched replacement for demucs.apply.apply_model (without random shifts).
+    Handles both single models and bags of models.
+
+    Returns:
+        torch.Tensor: Separated sources of shape (kept sources, channels, time)
+    """
+    if source_indices is None:
+        source_indices = list(range(len(model.sources)))
+    if not isinstance(model, BagOfModels):
+        return separate_segments(model, mix, batch_size, overlap, use_cuda_graph, source_indices)
+
+    # Weighted average of the sub-models, per source, as demucs.apply does
+    out = 0
+    totals = [0.0] * len(source_indices)
+    for sub_model, model_weights in zip(model.models, model.weights):
+        estimates = separate_segments(sub_model, mix, batch_size, overlap, use_cuda_graph, source_indices)
+        for k, inst_weight in enumerate(model_weights[i] for i in source_indices):
+            estimates[k] *= inst_weight
+            totals[k] += inst_weight
+        out = out + estimates
+    for k, total in enumerate(totals):
+        out[k] /= total
+    return out
+
+def extract_vocals(input_file, output_dir="extracted_vocals", batch_size=4, fp16=None,
+                   cuda_graph=False, compile_model=False, dtype="int16"):
     """
     Extract vocals from an audio file using Demucs.
     
     Args:
         input_file (str): Path to the input .wav file
         output_dir (str): Directory to save the extracted vocals
+        batch_size (int): Number of Demucs segments per forward pass
+        fp16 (bool): Run the model in half precision on CUDA (default: True on CUDA)
+        cuda_graph (bool): Capture the batched forward pass in a CUDA graph (CUDA only,
+                           ignored with compile_model, which records its own graphs)
+        compile_model (bool): Compile the model with torch.compile (first batch is slow)
+        dtype (str): Sample format of the output WAV, "int16" (16-bit PCM) or "float32"
     
     Returns:
         str: Path to the extracted vocals file
@@ -23,50 +194,61 @@ def extract_vocals(input_file, output_dir="extracted_vocals"):
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Load the audio file using librosa instead of torchaudio
-    import librosa
-    audio_np, sample_rate = librosa.load(input_file, sr=None, mono=False)
+    # Load the audio file as float32 with soundfile (always [length, channels], even for mono)
+    audio_np, sample_rate = soundfile.read(input_file, dtype="float32", always_2d=True)
     
-    # Convert librosa output to torch tensor
-    if audio_np.ndim == 1:
-        # If mono, reshape to [1, length]
-        waveform = torch.tensor(audio_np).unsqueeze(0)
-    else:
-        # If already multi-channel, convert to [channels, length]
-        waveform = torch.tensor(audio_np)
-    
-    # Ensure audio is in proper format for Demucs (stereo)
-    if waveform.shape[0] == 1:
-        # Convert mono to stereo by duplicating the channel
-        waveform = waveform.repeat(2, 1)
-    elif waveform.shape[0] > 2:
-        waveform = waveform[:2]  # Keep only first two channels if more than 2
-    
-    # Load the Demucs model (using "htdemucs" which is a high-quality model)
-    print("Loading Demucs model...")
-    model = get_model("htdemucs")
-    model.eval()
-    
-    # Move model to GPU if available
+    # Ensure audio is in proper format for Demucs (stereo):
+    # duplicate a mono channel, or keep only the first two channels if more than 2
+    stereo_channels = [0, 0] if audio_np.shape[1] == 1 else [0, 1]
+    
+    # Gather the channels into one contiguous float32 [channels, length] array (a single copy)
+    # and wrap it as a torch tensor without copying again
+    waveform = torch.from_numpy(np.ascontiguousarray(audio_np.T[stereo_channels], dtype=np.float32))
+    
+    # Use GPU if available
     device = "cuda" if torch.cuda.is_available() else "cpu"
     print(f"Using device: {device}")
-    model = model.to(device)
+    
+    # Half precision only makes sense on the GPU
+    use_fp16 = device == "cuda" and (fp16 is None or fp16)
+    if use_fp16:
+        print("Using FP16 inference")
+    
+    # Load the Demucs model (using "htdemucs" which is a high-quality model), cached per process
+    model = _get_model("htdemucs", device, use_fp16, compile_model)
+    
+    use_cuda_graph = cuda_graph and torch.cuda.is_available() and not compile_model
+    if cuda_graph and not torch.cuda.is_available():
+        print("(Ignoring CUDA graph capture: CUDA is not available)")
+    elif cuda_graph and compile_model:
+        # torch.compile(mode="reduce-overhead") already records CUDA graphs; don't nest a manual capture
+        print("(Ignoring CUDA graph capture: the compiled model records its own CUDA graphs)")
     
     # Apply the model to separate sources
     print("Separating audio sources...")
-    # Move audio to the same device as the model
-    waveform = waveform.to(device)
+    # Move audio to the same device as the model (from pinned memory so the copy is asynchronous)
+    if device == "cuda":
+        waveform = waveform.pin_memory().to(device, non_blocking=True)
+    if use_fp16:
+        waveform = waveform.half()
     
-    # Demucs expects the input in shape (batch, channels, time)
-    waveform = waveform.unsqueeze(0)  # Add batch dimension
+    # Only the vocals stem is needed (typically index 0 in htdemucs is vocals)
+    vocals_idx = model.sources.index("vocals")
     
-    with torch.no_grad():
-        sources = apply_model(model, waveform, device=device)[0]
+    # Split into overlapping segments and run them through Demucs in batches
+    # The autocast weight cache doesn't survive graph capture, so disable it when capturing
+    with torch.inference_mode(), torch.autocast(device_type="cuda", dtype=torch.float16, enabled=use_fp16,
+                                                cache_enabled=not use_cuda_graph):
+        sources = separate_batched(model, waveform, batch_size=batch_size,
+                                   use_cuda_graph=use_cuda_graph, source_indices=[vocals_idx])
     
-    # The output of Demucs has the shape (sources, channels, time)
-    # Extract the vocals (typically index 0 in htdemucs is vocals)
-    vocals_idx = model.sources.index("vocals")
-    vocals = sources[vocals_idx].cpu()
+    # The output has the shape (kept sources, channels, time), here just the vocals
+    if device == "cuda":
+        # Copy into pinned host memory without blocking, and prepare the output while it's in flight
+        vocals = torch.empty(sources[0].shape, dtype=torch.float32, pin_memory=True)
+        vocals.copy_(sources[0], non_blocking=True)
+    else:
+        vocals = sources[0].float()
     
     # Save the vocal track using torchaudio
     output_file = os.path.join(output_dir, f"vocals_{os.path.basename(input_file)}")
@@ -74,15 +256,43 @@ def extract_vocals(input_file, output_dir="extracted_vocals"):
     
     # Use scipy to save the file instead of torchaudio
     from scipy.io import wavfile
+    if device == "cuda":
+        torch.cuda.current_stream().synchronize()  # Wait for the device-to-host copy to land
     vocals_np = vocals.numpy()
+    if dtype == "int16":
+        # 16-bit PCM halves the file size; only scale down if the stem would otherwise clip
+        peak = max(float(np.max(np.abs(vocals_np))), 1.0)
+        vocals_np = (vocals_np / peak * 32767).astype(np.int16)
     wavfile.write(output_file, sample_rate, vocals_np.T)  # transpose to [time, channels]
     
     return output_file
 
 if __name__ == "__main__":
-    # Hardcoded input file path - replace with your actual file path
+    # Hardcoded default input file path - replace with your actual file path
     input_wav_file = "/Users/billy/Dropbox/Projects/Zoe+Charlie/ASSETS/Zoe/Zoe_Dad_Audio.wav"
     
+    parser = argparse.ArgumentParser(description="Extract vocals from an audio file using Demucs.")
+    parser.add_argument("input_file", nargs="?", default=input_wav_file,
+                        help="Path to the input .wav file")
+    parser.add_argument("-o", "--output-dir", default="extracted_vocals",
+                        help="Directory to save the extracted vocals (default: extracted_vocals)")
+    parser.add_argument("--batch-size", type=int, default=4,
+                        help="Number of Demucs segments per forward pass (default: 4)")
+    parser.add_argument("--fp16", action=argparse.BooleanOptionalAction, default=None,
+                        help="Run Demucs in half precision (default: enabled on CUDA)")
+    # torch.compile's "reduce-overhead" mode captures CUDA graphs itself, so the two are exclusive
+    graph_group = parser.add_mutually_exclusive_group()
+    graph_group.add_argument("--cuda-graph", action="store_true",
+                             help="Capture the Demucs forward pass in a CUDA graph and replay it per batch")
+    graph_group.add_argument("--compile", action="store_true",
+                             help="Compile Demucs with torch.compile to fuse kernels (slow first batch)")
+    parser.add_argument("--dtype", choices=["int16", "float32"], default="int16",
+                        help="Sample format of the output WAV (default: int16)")
+    args = parser.parse_args()
+    
     # Extract vocals
-    output_file = extract_vocals(input_wav_file)
+    output_file = extract_vocals(args.input_file, args.output_dir,
+                                 batch_size=args.batch_size, fp16=args.fp16,
+                                 cuda_graph=args.cuda_graph, compile_model=args.compile,
+                                 dtype=args.dtype)
     print(f"Vocal extraction complete. Vocals saved to: {output_file}")
\ No newline at end of file
@@ -1,15 +1,43 @@
 import os
+
+# Match CPU thread pools to (roughly) the physical core count instead of one thread per SMT
+# sibling. This has to happen before the inference libraries are imported.
+DEFAULT_CPU_THREADS = max(1, (os.cpu_count() or 2) // 2)
+os.environ.setdefault("OMP_NUM_THREADS", str(DEFAULT_CPU_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(DEFAULT_CPU_THREADS))
+
 import subprocess
 import argparse
-import whisper
+import ctranslate2
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.audio import pad_or_trim
+from faster_whisper.tokenizer import Tokenizer
+from faster_whisper.transcribe import get_suppressed_tokens
+from faster_whisper.vad import get_speech_timestamps
 import sys
 import time
+import multiprocessing
+import queue
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 SUPPORTED_EXTENSIONS = {".mp4", ".mov", ".avi", ".mkv", ".wmv", ".flv", ".webm", ".m4v"} # Add more if needed
 DEFAULT_OUTPUT_FILENAME = "video_transcriptions.txt"
 DEFAULT_WHISPER_MODEL = "base" # Options: tiny, base, small, medium, large (larger = more accurate, slower, more VRAM)
-TEMP_AUDIO_FILENAME = "_temp_audio.wav" # Temporary file for extracted audio
+AUDIO_SAMPLE_RATE = 16000 # Whisper expects 16kHz mono float32 audio
+WINDOW_SAMPLES = 30 * AUDIO_SAMPLE_RATE # Whisper's 30s input window; shorter clips are batched across files
+PREFETCH_FILES = 2 # Number of files whose audio is extracted ahead of the one being transcribed
+# faster-whisper's silence gate, applied to batched short clips too: a window is treated
+# as silent if its no-speech probability is above the threshold and its average
+# token log-probability is below the log-prob threshold
+NO_SPEECH_THRESHOLD = 0.6
+LOG_PROB_THRESHOLD = -1.0
+WORKER_POLL_SECONDS = 5 # How often to check for worker processes that died without reporting back
+DEFAULT_BATCH_SIZE = 16 # Number of 30s audio windows decoded together in one Whisper forward pass
+# CTranslate2 compute types for --compute-type ("auto": int8 on CPU, float16 on GPU)
+COMPUTE_TYPES = ["auto", "int8", "int8_float16", "int8_float32", "int8_bfloat16", "float16", "bfloat16", "float32"]
 
 # --- Functions ---
 
@@ -18,70 +46,261 @@ def is_video_file(filename):
     _, ext = os.path.splitext(filename)
     return ext.lower() in SUPPORTED_EXTENSIONS
 
-def extract_audio(video_path, audio_path):
+def extract_audio(video_path):
     """
-    Extracts audio from a video file using ffmpeg.
-    Returns True on success, False on failure.
+    Extracts audio from a video file using ffmpeg, piping raw PCM straight into memory.
+    Returns a 16kHz mono float32 numpy array on success, None on failure.
     """
     print(f"   Extracting audio from '{os.path.basename(video_path)}'...")
     command = [
         'ffmpeg',
+        '-nostdin',            # Never wait for keyboard input
+        '-hide_banner',
+        '-loglevel', 'error',  # Only write errors to stderr, not per-frame progress
+        '-threads', '0',       # Let the decoder use all cores
         '-i', video_path,      # Input file
-        '-y',                  # Overwrite output file without asking
         '-vn',                 # Disable video recording
-        '-acodec', 'pcm_s16le',# Audio codec: WAV format (signed 16-bit PCM)
-        '-ar', '16000',        # Audio sample rate: 16kHz (recommended for Whisper)
+        '-f', 'f32le',         # Output format: raw 32-bit float PCM (no WAV container)
+        '-ar', str(AUDIO_SAMPLE_RATE), # Audio sample rate: 16kHz (recommended for Whisper)
         '-ac', '1',            # Audio channels: 1 (mono)
-        audio_path             # Output file
+        'pipe:1'               # Write to stdout instead of a temp file
     ]
     try:
-        # Use subprocess.run for better control and error handling
-        # stderr=subprocess.PIPE and stdout=subprocess.PIPE hides ffmpeg's output unless there's an error
-        # Use stderr=subprocess.DEVNULL and stdout=subprocess.DEVNULL to completely silence ffmpeg
-        result = subprocess.run(command, check=True, text=True, capture_output=True)
-                                #stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # Uncomment to silence ffmpeg
-        print(f"   Audio extracted successfully to '{os.path.basename(audio_path)}'.")
-        return True
+        # communicate() drains stdout and stderr together, so a chatty ffmpeg can't deadlock the pipe
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=1 << 20)
+        raw_audio, stderr = process.communicate()
+        if process.returncode != 0:
+            print(f"\nError during audio extraction for '{os.path.basename(video_path)}':", file=sys.stderr)
+            print(f"  Command: {' '.join(command)}", file=sys.stderr)
+            print(f"  Return Code: {process.returncode}", file=sys.stderr)
+            print(f"  Stderr: {stderr.decode(errors='replace')}", file=sys.stderr)
+            return None
+        audio = np.frombuffer(raw_audio, dtype=np.float32)
+        print(f"   Audio extracted successfully ({len(audio) / AUDIO_SAMPLE_RATE:.1f}s).")
+        return audio
     except FileNotFoundError:
         print("\nError: 'ffmpeg' command not found. Please ensure ffmpeg is installed and in your system's PATH.", file=sys.stderr)
-        return False
-    except subprocess.CalledProcessError as e:
-        print(f"\nError during audio extraction for '{os.path.basename(video_path)}':", file=sys.stderr)
-        print(f"  Command: {' '.join(e.cmd)}", file=sys.stderr)
-        print(f"  Return Code: {e.returncode}", file=sys.stderr)
-        print(f"  Stderr: {e.stderr}", file=sys.stderr)
-        return False
+        return None
     except Exception as e:
         print(f"\nAn unexpected error occurred during audio extraction for '{os.path.basename(video_path)}': {e}", file=sys.stderr)
-        return False
+        return None
+
+def prefetch_audio(video_paths, prefetch=PREFETCH_FILES):
+    """
+    Yields extract_audio(path) for each path, in order, while ffmpeg extracts
+    the next files in a background thread. This overlaps audio extraction of
+    upcoming files with transcription of the current one.
+    """
+    paths = iter(video_paths)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque(executor.submit(extract_audio, path) for _, path in zip(range(prefetch), paths))
+        while pending:
+            audio = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(executor.submit(extract_audio, next_path))
+            yield audio
 
-def transcribe_audio(audio_path, model):
+def transcribe_audio(audio, model, name, batch_size=1):
     """
-    Transcribes audio using the loaded Whisper model.
+    Transcribes an in-memory 16kHz mono float32 audio array using the loaded Whisper model.
+    With batch_size > 1, 'model' must be a BatchedInferencePipeline, which decodes
+    that many 30s windows of the audio at once.
+    'name' is only used for log messages.
     Returns the transcription text or None on failure.
     """
-    print(f"   Transcribing '{os.path.basename(audio_path)}'...")
+    print(f"   Transcribing '{name}'...")
     try:
         start_time = time.time()
-        # Load the model inside the function if you want per-file model loading (less efficient)
-        # model = whisper.load_model(whisper_model_name)
-        result = model.transcribe(audio_path, fp16=False) # fp16=False for CPU, can be True for GPU
+        batch_options = {"batch_size": batch_size} if batch_size > 1 else {}
+        segments, _ = model.transcribe(audio, beam_size=5, **batch_options)
+        # Segments are decoded lazily, so joining them is where the work happens
+        text = "".join(segment.text for segment in segments)
         end_time = time.time()
         duration = end_time - start_time
         print(f"   Transcription complete ({duration:.2f}s).")
-        return result['text']
+        return text
     except Exception as e:
-        print(f"\nError during transcription for '{os.path.basename(audio_path)}': {e}", file=sys.stderr)
+        print(f"\nError during transcription for '{name}': {e}", file=sys.stderr)
         return None
 
-def cleanup_temp_file(filepath):
-    """Deletes a file if it exists."""
-    if os.path.exists(filepath):
+def transcribe_batch(audios, model, names):
+    """
+    Transcribes several clips of at most 30 seconds each in a single batched Whisper decode.
+    Each clip is exactly one 30s window, so their spectrograms are stacked and
+    run through the CTranslate2 model together (language detected per clip).
+    Uses the same token suppression and no-speech gate as faster-whisper's
+    own transcribe, so silent clips come back empty instead of hallucinated.
+    'model' is a WhisperModel or a BatchedInferencePipeline wrapping one.
+    'names' is only used for log messages.
+    Returns a list with one transcription text (or None on failure) per clip.
+    """
+    print(f"   Transcribing batch of {len(audios)} short clip(s): {', '.join(names)}...")
+    whisper_model = model.model if isinstance(model, BatchedInferencePipeline) else model
+    try:
+        start_time = time.time()
+        # Pad every clip's spectrogram to the full window and stack them into one batch
+        feature_extractor = whisper_model.feature_extractor
+        features = np.stack([
+            pad_or_trim(feature_extractor(audio), feature_extractor.nb_max_frames) for audio in audios
+        ])
+        encoder_output = whisper_model.encode(features)
+
+        # Build each clip's prompt (start of transcript, language, task, no timestamps)
+        multilingual = whisper_model.model.is_multilingual
+        languages = [None] * len(audios)
+        if multilingual:
+            # Top language token per clip, e.g. "<|en|>" -> "en"
+            languages = [probs[0][0][2:-2] for probs in whisper_model.model.detect_language(encoder_output)]
+        tokenizers = [Tokenizer(whisper_model.hf_tokenizer, multilingual, task="transcribe", language=language)
+                      for language in languages]
+        prompts = [tokenizer.sot_sequence + [tokenizer.no_timestamps] for tokenizer in tokenizers]
+
+        results = whisper_model.model.generate(
+            encoder_output, prompts, beam_size=5, max_length=whisper_model.max_length,
+            # Same defaults as transcribe(): no blank output, no non-speech/special tokens
+            suppress_blank=True, suppress_tokens=get_suppressed_tokens(tokenizers[0], [-1]),
+            return_scores=True, return_no_speech_prob=True,
+        )
+
+        transcriptions = []
+        for tokenizer, result in zip(tokenizers, results):
+            tokens = result.sequences_ids[0]
+            # Average log-probability per token, computed as faster-whisper does (length_penalty=1)
+            avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD and avg_logprob < LOG_PROB_THRESHOLD:
+                transcriptions.append("") # Silence: don't keep the hallucinated text
+            else:
+                transcriptions.append(tokenizer.decode(tokens))
+        end_time = time.time()
+        duration = end_time - start_time
+        print(f"   Batch transcription complete ({duration:.2f}s).")
+        return transcriptions
+    except Exception as e:
+        print(f"\nError during batched transcription for {', '.join(names)}: {e}", file=sys.stderr)
+        return [None] * len(audios)
+
+def load_whisper_model(model_name, device, compute_type, batch_size, cpu_threads=0, device_index=0):
+    """
+    Loads a faster-whisper model. With batch_size > 1 it is wrapped in a
+    BatchedInferencePipeline, which splits each file into 30s windows and
+    decodes them together. cpu_threads=0 uses OMP_NUM_THREADS.
+    """
+    model = WhisperModel(model_name, device=device, device_index=device_index,
+                         compute_type=compute_type, cpu_threads=cpu_threads)
+    if batch_size > 1:
+        model = BatchedInferencePipeline(model=model)
+    return model
+
+def transcribe_files(video_paths, indices, model, batch_size):
+    """
+    Transcribes video_paths[i] for each i in indices, extracting the audio of
+    upcoming files in the background while the current one transcribes.
+    With batch_size > 1, clips of 30s or less are queued and transcribed
+    batch_size at a time with transcribe_batch; longer files are batched
+    over their own 30s windows.
+    Yields (index, transcription) pairs, not strictly in order (queued short
+    clips come out when their batch runs); transcription is None on failure.
+    """
+    paths = [video_paths[i] for i in indices]
+    short_clips = [] # (index, filename, audio) of short clips waiting for a batched decode
+    # 1. Extract Audio (into memory, in the background while the previous file transcribes)
+    for n, (i, video_path, audio) in enumerate(zip(indices, paths, prefetch_audio(paths))):
+        filename = os.path.basename(video_path)
+        print(f"\nProcessing file {i+1}/{len(video_paths)}: {filename}")
+        is_last_file = n == len(paths) - 1
+
+        # 2. Transcribe Audio (short clips are queued and decoded together)
+        if audio is None:
+            yield i, None
+        elif batch_size > 1 and len(audio) <= WINDOW_SAMPLES:
+            # Silero VAD first, as the batched pipeline does for long files: clips without speech skip Whisper
+            if get_speech_timestamps(audio):
+                short_clips.append((i, filename, audio))
+                print(f"   Queued for batched transcription ({len(short_clips)}/{batch_size}).")
+            else:
+                print("   No speech detected, skipping transcription.")
+                yield i, ""
+        else:
+            yield i, transcribe_audio(audio, model, filename, batch_size)
+
+        if short_clips and (len(short_clips) >= batch_size or is_last_file):
+            batch_indices, names, audios = zip(*short_clips)
+            yield from zip(batch_indices, transcribe_batch(audios, model, names))
+            short_clips = []
+
+def transcribe_worker(rank, num_workers, video_paths, model_options, result_queue):
+    """
+    Worker process entry point. Loads its own model copy (on GPU 'rank' when
+    using CUDA, wrapping around when there are more workers than GPUs),
+    transcribes every num_workers-th file starting at 'rank', and sends
+    (index, transcription) pairs back. (None, rank) signals it is done.
+    """
+    try:
+        device_index = rank % ctranslate2.get_cuda_device_count() if model_options["device"] == "cuda" else 0
+        model = load_whisper_model(device_index=device_index, **model_options)
+        indices = range(rank, len(video_paths), num_workers)
+        for index, transcription in transcribe_files(video_paths, indices, model, model_options["batch_size"]):
+            result_queue.put((index, transcription))
+    except Exception as e:
+        print(f"\nError in transcription worker {rank}: {e}", file=sys.stderr)
+    finally:
+        result_queue.put((None, rank))
+
+def transcribe_in_workers(video_paths, num_workers, model_options):
+    """
+    Spreads the files over num_workers processes, each holding its own model.
+    Yields (index, transcription) pairs as they arrive, not in file order.
+    A worker that dies outright (segfault, OOM kill, CUDA abort) is reported
+    and its remaining files are never yielded.
+    """
+    # spawn (not fork) so each worker initializes CUDA cleanly
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    workers = [
+        context.Process(target=transcribe_worker,
+                        args=(rank, num_workers, video_paths, model_options, result_queue))
+        for rank in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+    finished = set() # Ranks that are done, normally or not
+    exited = set()   # Ranks found dead without having sent their (None, rank) sentinel
+    while len(finished) < num_workers:
         try:
-            os.remove(filepath)
-            # print(f"   Cleaned up temporary file: {os.path.basename(filepath)}")
-        except OSError as e:
-            print(f"\nWarning: Could not delete temporary file '{os.path.basename(filepath)}': {e}", file=sys.stderr)
+            index, value = result_queue.get(timeout=WORKER_POLL_SECONDS)
+        except queue.Empty:
+            # A killed worker never sends its sentinel. Whatever it did send is already in the
+            # queue once it's found dead, so only give up on it after the queue runs empty again.
+            for rank in exited - finished:
+                print(f"\nError: transcription worker {rank} died (exit code {workers[rank].exitcode}).", file=sys.stderr)
+                finished.add(rank)
+            exited = {rank for rank, worker in enumerate(workers)
+                      if rank not in finished and not worker.is_alive()}
+            continue
+        if index is None:
+            finished.add(value) # (None, rank): that worker is done
+        else:
+            yield index, value
+    for worker in workers:
+        worker.join()
+
+def write_transcription(outfile, filename, transcription):
+    """
+    Writes one file's transcription block (or a failure marker) to the output file
+    and flushes it to disk, so an interrupted run keeps everything finished so far.
+    Returns True if a transcription was written.
+    """
+    if transcription is not None:
+        outfile.write(f"--- Transcription for: {filename} ---\n")
+        outfile.write(transcription.strip()) # Remove leading/trailing whitespace
+        outfile.write("\n\n") # Add blank lines for separation
+    else:
+        print(f"   Skipping transcription for '{filename}' due to previous errors.")
+        outfile.write(f"--- Transcription FAILED for: {filename} ---\n\n") # Log failure
+    outfile.flush()
+    os.fsync(outfile.fileno())
+    return transcription is not None
 
 # --- Main Execution ---
 
@@ -95,6 +314,14 @@ def main():
                         help=f"Whisper model size to use (default: {DEFAULT_WHISPER_MODEL})")
     parser.add_argument("--force-cpu", action="store_true",
                         help="Force Whisper to use CPU even if GPU is available.")
+    parser.add_argument("--compute-type", default="auto", choices=COMPUTE_TYPES,
+                        help="CTranslate2 compute type for the model weights and activations (default: auto, i.e. int8 on CPU, float16 on GPU)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of 30s windows transcribed together in one batched decode: windows of a long video, or whole short (<= 30s) videos; 1 disables batching (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes, each with its own model copy (default: one per GPU, or 1 on CPU)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_CPU_THREADS,
+                        help=f"Total CPU threads for Whisper, split across workers (default: {DEFAULT_CPU_THREADS}, about one per physical core)")
 
     args = parser.parse_args()
 
@@ -107,9 +334,10 @@ def main():
         sys.exit(1)
 
     # Find video files
+    # (scandir entries carry their file type, so no extra stat call per file)
     video_files = [
-        f for f in os.listdir(input_directory)
-        if os.path.isfile(os.path.join(input_directory, f)) and is_video_file(f)
+        entry.name for entry in os.scandir(input_directory)
+        if entry.is_file() and is_video_file(entry.name)
     ]
 
     if not video_files:
@@ -120,57 +348,65 @@ def main():
     print(f"Using Whisper model: '{whisper_model_name}'")
     print(f"Output will be saved to: '{output_filepath}'")
 
-    # Load Whisper model (do this once)
-    print("Loading Whisper model...")
-    try:
-        if args.force_cpu:
-            print("(Forcing CPU usage)")
-            model = whisper.load_model(whisper_model_name, device="cpu")
-        else:
-            # Whisper automatically detects GPU if available and PyTorch is correctly installed
-            model = whisper.load_model(whisper_model_name)
-            # Check device being used (optional)
-            # try:
-            #     import torch
-            #     device = "GPU (CUDA)" if torch.cuda.is_available() else "CPU"
-            #     print(f"(Using device: {device})")
-            # except ImportError:
-            #     print("(Using device: CPU - PyTorch not found or no CUDA)")
+    if args.force_cpu:
+        print("(Forcing CPU usage)")
+        device = "cpu"
+    else:
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    # By default CTranslate2 runs int8 on CPU and float16 on GPU
+    compute_type = args.compute_type
+    if compute_type == "auto":
+        compute_type = "int8" if device == "cpu" else "float16"
+    print(f"(Using device: {device}, compute type: {compute_type})")
+    num_workers = args.workers
+    if num_workers is None:
+        num_workers = ctranslate2.get_cuda_device_count() if device == "cuda" else 1
+    num_workers = max(1, min(num_workers, len(video_files)))
 
-    except Exception as e:
-        print(f"\nError loading Whisper model '{whisper_model_name}': {e}", file=sys.stderr)
-        print("Ensure the model name is correct and you have enough memory/VRAM.", file=sys.stderr)
-        sys.exit(1)
-    print("Model loaded successfully.")
+    model_options = {
+        "model_name": whisper_model_name,
+        "device": device,
+        "compute_type": compute_type,
+        "batch_size": args.batch_size,
+        # Split the thread budget so parallel workers don't oversubscribe the cores
+        "cpu_threads": max(1, args.threads // num_workers),
+    }
+
+    video_paths = [os.path.join(input_directory, f) for f in video_files]
+    if num_workers > 1:
+        # Each worker loads its own model copy
+        print(f"Starting {num_workers} worker processes...")
+        results = transcribe_in_workers(video_paths, num_workers, model_options)
+    else:
+        # Load Whisper model (do this once)
+        print("Loading Whisper model...")
+        try:
+            model = load_whisper_model(**model_options)
+        except Exception as e:
+            print(f"\nError loading Whisper model '{whisper_model_name}': {e}", file=sys.stderr)
+            print("Ensure the model name is correct and you have enough memory/VRAM.", file=sys.stderr)
+            sys.exit(1)
+        print("Model loaded successfully.")
+        results = transcribe_files(video_paths, range(len(video_paths)), model, args.batch_size)
 
     # Process each video file
     successful_transcriptions = 0
-    with open(output_filepath, 'w', encoding='utf-8') as outfile:
-        for i, filename in enumerate(video_files):
-            print(f"\nProcessing file {i+1}/{len(video_files)}: {filename}")
-            video_path = os.path.join(input_directory, filename)
-            # Define temp audio path relative to input directory or a dedicated temp dir
-            temp_audio_path = os.path.join(input_directory, TEMP_AUDIO_FILENAME)
-
-            transcription = None # Reset for each file
-
-            # 1. Extract Audio
-            if extract_audio(video_path, temp_audio_path):
-                # 2. Transcribe Audio
-                transcription = transcribe_audio(temp_audio_path, model)
-
-            # 3. Write to Output File
-            if transcription is not None:
-                outfile.write(f"--- Transcription for: {filename} ---\n")
-                outfile.write(transcription.strip()) # Remove leading/trailing whitespace
-                outfile.write("\n\n") # Add blank lines for separation
-                successful_transcriptions += 1
-            else:
-                print(f"   Skipping transcription for '{filename}' due to previous errors.")
-                outfile.write(f"--- Transcription FAILED for: {filename} ---\n\n") # Log failure
+    transcriptions = {} # index -> transcription, waiting to be written in file order
+    next_to_write = 0
+    with open(output_filepath, 'w', encoding='utf-8', buffering=1) as outfile: # Line-buffered
+        for index, transcription in results:
+            transcriptions[index] = transcription
+
+            # 3. Write to Output File (in the original file order)
+            while next_to_write in transcriptions:
+                if write_transcription(outfile, video_files[next_to_write], transcriptions.pop(next_to_write)):
+                    successful_transcriptions += 1
+                next_to_write += 1
 
-            # 4. Cleanup Temporary Audio File
-            cleanup_temp_file(temp_audio_path)
+        # Files a worker never reported back (e.g. it failed to load its model) are logged as failures
+        for index in range(next_to_write, len(video_files)):
+            if write_transcription(outfile, video_files[index], transcriptions.pop(index, None)):
+                successful_transcriptions += 1
 
     print("\n--------------------")
     print("Processing Complete.")
@@ -3,10 +3,21 @@ import os
 import cv2
 import math
 import argparse
+import multiprocessing
 import numpy as np
-import face_recognition
+import dlib
+from face_recognition import api as face_recognition_api
 from PIL import Image, ImageDraw
 import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba is optional: without it the JIT-decorated helpers run as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
 
 """
 Align Face for Match Cuts Script
@@ -57,13 +68,23 @@ Arguments:
                     pixels (default: 200). Controls the scale of the face.
 --use_cnn           (optional flag) Use the CNN model for face detection instead
                     of the default HOG model (slower, potentially more accurate).
+--use_dnn           (optional flag) Use OpenCV's DNN (res10 SSD) face detector
+                    instead of the default HOG model (faster, multithreaded).
+--dnn_model_dir     (optional) Folder containing the DNN detector files
+                    'deploy.prototxt' and 'res10_300x300_ssd_iter_140000.caffemodel'
+                    (default: the folder this script is in).
 --jpg               (optional flag) Output in JPG format with a white background.
                     Default is PNG format with transparency.
 --testing           (optional flag) Process only the first 10 images found in
                     the input folder for quick testing.
 --debug_draw        (optional flag) Save additional debug images (in a
-                    '_debug_affine' subdirectory) showing the final warped
-                    image with the target eye locations marked.
+                    '_debug_affine' subdirectory) showing the region of the
+                    final image around the face with the target eye
+                    locations marked.
+--workers           (optional) Number of worker processes used to process
+                    images in parallel (default: one per CPU core, capped at
+                    8 and by available memory, since each worker holds a
+                    full-size output canvas).
 
 Notes:
 ------
@@ -76,8 +97,58 @@ Notes:
   be cropped if they fall outside the canvas boundaries after transformation.
 """
 
+# --- Detection Settings ---
+# Face detection cost grows with pixel count, so images larger than
+# DETECTION_MAX_DIM are downscaled to DETECTION_DIM (longest side) for
+# detection only. Landmarks are still computed at full resolution.
+DETECTION_MAX_DIM = 1024
+DETECTION_DIM = 640
+# Reference images are downscaled to this size (longest side) before detection
+# and encoding; encodings don't improve once the face is ~150px wide
+REFERENCE_MAX_DIM = 800
+
+# OpenCV DNN (res10 SSD) face detector files, expected in --dnn_model_dir
+DNN_PROTOTXT = "deploy.prototxt"
+DNN_CAFFEMODEL = "res10_300x300_ssd_iter_140000.caffemodel"
+DNN_CONFIDENCE = 0.5 # Minimum detection confidence to accept a face
+
+# The DNN detector, loaded once per process by load_dnn_detector
+_DNN_NET = None
+
+# dlib models, loaded once per process when face_recognition is imported.
+# They are called directly (see the _dlib_* helpers) instead of going through
+# face_recognition's wrappers, which re-select the model and convert every
+# landmark group on each call.
+_FACE_DETECTOR = face_recognition_api.face_detector               # HOG
+_CNN_FACE_DETECTOR = face_recognition_api.cnn_face_detector
+_POSE_PREDICTOR_68 = face_recognition_api.pose_predictor_68_point # Landmarks
+_POSE_PREDICTOR_5 = face_recognition_api.pose_predictor_5_point   # Alignment for encodings
+_FACE_ENCODER = face_recognition_api.face_encoder
+
+# HOG detectors for threads other than the main one (see _thread_face_detector)
+_THREAD_LOCAL = threading.local()
+
 # --- Helper Functions ---
 
+def read_image_bgr(path):
+    """
+    Decodes an image file with OpenCV (libjpeg-turbo / libpng).
+
+    Args:
+        path (str): Path to the image.
+
+    Returns:
+        numpy.ndarray: 8-bit 3-channel BGR image. EXIF orientation is ignored,
+                       matching face_recognition.load_image_file.
+
+    Raises:
+        ValueError: If the file cannot be read or decoded.
+    """
+    image = cv2.imread(path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError("could not read or decode the image")
+    return image
+
 def load_reference_encodings(ref_path):
     """
     Loads face encodings from reference image(s) or a folder.
@@ -87,8 +158,8 @@ def load_reference_encodings(ref_path):
                         or a directory containing reference images.
 
     Returns:
-        list: A list of face encoding arrays (numpy.ndarray). Returns an
-              empty list if no valid references or faces are found.
+        numpy.ndarray: The face encodings stacked into an (N, 128) array.
+                       Has zero rows if no valid references or faces are found.
     """
     if os.path.isdir(ref_path):
         # Load from directory
@@ -100,35 +171,183 @@ def load_reference_encodings(ref_path):
 
     if not ref_paths:
         print(f"Error: No valid image files found for reference path: {ref_path}")
-        return []
+        return np.empty((0, 128))
 
-    encodings = []
     print(f"Loading reference faces from: {', '.join([os.path.basename(p) for p in ref_paths])}")
-    for r in ref_paths:
-        try:
-            image = face_recognition.load_image_file(r)
-            # Use default HOG model for reference encoding (faster)
-            face_encs = face_recognition.face_encodings(image)
-            if face_encs:
-                 encodings.append(face_encs[0]) # Assuming one face per reference image
-                 print(f"  Loaded encoding from {os.path.basename(r)}")
-            else:
-                 print(f"Warning: No face found in reference image {r}")
-        except Exception as e:
-             print(f"Error loading reference image {r}: {e}")
+    if len(ref_paths) == 1:
+        encodings = [_load_reference_encoding(ref_paths[0])]
+    else:
+        # References are independent: decode and detect them in parallel threads (OpenCV and the
+        # per-thread HOG detectors release the GIL; encoding holds it, so that part stays serial).
+        # Threads reuse the already-loaded models, where spawned processes would reload them all
+        num_workers = min(len(ref_paths), os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            encodings = list(executor.map(_load_reference_encoding, ref_paths))
+    encodings = [enc for enc in encodings if enc is not None]
 
     if not encodings:
         print("Warning: No face encodings could be loaded from reference images.")
-    return encodings
+        return np.empty((0, 128))
+    # Stack once so matching can compare against all references in a single vectorized call
+    return np.asarray(encodings)
 
-def get_target_face(image, reference_encodings, use_cnn=False, tolerance=0.6):
+def _load_reference_encoding(path):
+    """
+    Computes the face encoding of a single reference image (one face assumed).
+
+    Args:
+        path (str): Path to the reference image.
+
+    Returns:
+        numpy.ndarray: The 128-d face encoding, or None if no face was found or loading failed.
+    """
+    try:
+        image = cv2.cvtColor(read_image_bgr(path), cv2.COLOR_BGR2RGB)
+        img_h, img_w = image.shape[:2]
+        if max(img_h, img_w) > REFERENCE_MAX_DIM:
+            scale = REFERENCE_MAX_DIM / max(img_h, img_w)
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # Use default HOG model for reference encoding (faster), with this thread's own detector
+        face_encs = _dlib_face_encodings(image, _dlib_face_locations(image, hog_detector=_thread_face_detector()))
+        if face_encs:
+            print(f"  Loaded encoding from {os.path.basename(path)}")
+            return face_encs[0] # Assuming one face per reference image
+        print(f"Warning: No face found in reference image {path}")
+    except Exception as e:
+        print(f"Error loading reference image {path}: {e}")
+    return None
+
+def _thread_face_detector():
+    """
+    Returns the calling thread's own dlib HOG detector, creating it on first use.
+    A detector can't be shared between threads: it rebuilds the feature pyramid
+    stored inside it on every call, with the GIL released.
+    """
+    detector = getattr(_THREAD_LOCAL, "face_detector", None)
+    if detector is None:
+        detector = dlib.get_frontal_face_detector()
+        _THREAD_LOCAL.face_detector = detector
+    return detector
+
+def _dlib_face_locations(image, model="hog", hog_detector=None):
+    """
+    Detects faces with dlib's HOG or CNN detector (upsampling once, like face_recognition).
+    hog_detector overrides the shared HOG detector (needed when called from several threads).
+
+    Returns:
+        list: Face locations as (top, right, bottom, left) tuples, clamped to the image bounds.
+    """
+    img_h, img_w = image.shape[:2]
+    if model == "cnn":
+        rects = [detection.rect for detection in _CNN_FACE_DETECTOR(image, 1)]
+    else:
+        rects = (hog_detector or _FACE_DETECTOR)(image, 1)
+    return [(max(r.top(), 0), min(r.right(), img_w), min(r.bottom(), img_h), max(r.left(), 0))
+            for r in rects]
+
+def _dlib_face_encodings(image, face_locations):
+    """
+    Computes the 128-d encoding of each face location (same as face_recognition.face_encodings).
+    """
+    return [np.array(_FACE_ENCODER.compute_face_descriptor(
+                image, _POSE_PREDICTOR_5(image, dlib.rectangle(left, top, right, bottom)), 1))
+            for top, right, bottom, left in face_locations]
+
+def _dlib_face_landmarks(image, face_location):
+    """
+    Predicts the 68-point landmarks of one face and returns the groups this
+    script uses ('nose_bridge', 'left_eye', 'right_eye'), as lists of (x, y)
+    tuples in the face_recognition.face_landmarks format.
+    """
+    top, right, bottom, left = face_location
+    points = [(p.x, p.y) for p in _POSE_PREDICTOR_68(image, dlib.rectangle(left, top, right, bottom)).parts()]
+    return {
+        "nose_bridge": points[27:31],
+        "left_eye": points[36:42],
+        "right_eye": points[42:48],
+    }
+
+def load_dnn_detector(model_dir):
+    """
+    Loads the OpenCV DNN (res10 SSD) face detector for this process.
+
+    Args:
+        model_dir (str): Folder containing DNN_PROTOTXT and DNN_CAFFEMODEL.
+    """
+    global _DNN_NET
+    _DNN_NET = cv2.dnn.readNetFromCaffe(os.path.join(model_dir, DNN_PROTOTXT),
+                                        os.path.join(model_dir, DNN_CAFFEMODEL))
+
+def detect_faces_dnn(image):
+    """
+    Detects faces with the OpenCV DNN detector (see load_dnn_detector).
+
+    Args:
+        image (numpy.ndarray): RGB image array.
+
+    Returns:
+        list: Face locations as (top, right, bottom, left) tuples, most
+              confident first, in the same format as face_recognition.
+    """
+    img_h, img_w = image.shape[:2]
+    # The network takes a 300x300 BGR blob; swapRB converts our RGB input
+    blob = cv2.dnn.blobFromImage(image, 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=True)
+    _DNN_NET.setInput(blob)
+    detections = _DNN_NET.forward() # Shape (1, 1, N, 7): [_, _, confidence, x1, y1, x2, y2]
+
+    face_locations = []
+    for detection in sorted(detections[0, 0], key=lambda d: d[2], reverse=True):
+        if detection[2] < DNN_CONFIDENCE:
+            break
+        # Box corners are relative to the image size; clamp to the image bounds
+        left = max(int(detection[3] * img_w), 0)
+        top = max(int(detection[4] * img_h), 0)
+        right = min(int(detection[5] * img_w), img_w)
+        bottom = min(int(detection[6] * img_h), img_h)
+        if right > left and bottom > top:
+            face_locations.append((top, right, bottom, left))
+    return face_locations
+
+def detect_faces(image, model="hog"):
+    """
+    Detects faces. For the face_recognition detectors, the detector runs on a
+    downscaled copy of large images and the locations are mapped back to
+    full-resolution coordinates.
+
+    Args:
+        image (numpy.ndarray): RGB image array.
+        model (str): 'hog' or 'cnn' face_recognition detector, or 'dnn' for
+                     the OpenCV DNN detector (which does its own resizing).
+
+    Returns:
+        list: Face locations as (top, right, bottom, left) tuples in the
+              coordinates of the full-resolution image.
+    """
+    if model == "dnn":
+        return detect_faces_dnn(image)
+
+    img_h, img_w = image.shape[:2]
+    if max(img_h, img_w) <= DETECTION_MAX_DIM:
+        return _dlib_face_locations(image, model=model)
+
+    scale = DETECTION_DIM / max(img_h, img_w)
+    small_image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_locations = _dlib_face_locations(small_image, model=model)
+    # Scale back up, clamped to the image bounds
+    return [
+        (max(int(round(top / scale)), 0), min(int(round(right / scale)), img_w),
+         min(int(round(bottom / scale)), img_h), max(int(round(left / scale)), 0))
+        for top, right, bottom, left in small_locations
+    ]
+
+def get_target_face(image, reference_encodings, detector="hog", tolerance=0.6):
     """
     Detects faces in an image and selects the one best matching the reference encodings.
 
     Args:
-        image (numpy.ndarray): Image array (RGB format from face_recognition.load_image_file).
-        reference_encodings (list): List of known face encodings.
-        use_cnn (bool): Whether to use the CNN model for detection.
+        image (numpy.ndarray): RGB image array.
+        reference_encodings (numpy.ndarray): (N, 128) array of known face encodings.
+        detector (str): Face detector to use: 'hog', 'cnn' or 'dnn'.
         tolerance (float): How much distance between faces to consider it a match.
                            Lower is stricter. 0.6 is typical.
 
@@ -138,151 +357,173 @@ def get_target_face(image, reference_encodings, use_cnn=False, tolerance=0.6):
                'best_landmarks' is a dictionary of landmark points.
     """
     start_time = time.time()
-    model = "cnn" if use_cnn else "hog"
-    face_locations = face_recognition.face_locations(image, model=model)
+    face_locations = detect_faces(image, model=detector)
 
     if not face_locations:
         return None, None, None # No faces detected
 
-    face_encodings = face_recognition.face_encodings(image, face_locations)
-
     best_face_location = None
     best_landmarks = None
     best_distance = float('inf')
 
-    if not reference_encodings:
+    if len(reference_encodings) == 0:
         # If no references provided, default to the first detected face
+        # (no encodings needed, since there is nothing to compare them against)
         print("  No reference encodings provided, using the first detected face.")
         best_face_location = face_locations[0]
         best_distance = 0 # Assign arbitrary distance
     else:
-        # Find the face with the minimum distance to any reference encoding
-        for location, encoding in zip(face_locations, face_encodings):
-            distances = face_recognition.face_distance(reference_encodings, encoding)
-            min_distance = np.min(distances)
-            # Check if this face is a better match than current best and meets tolerance
-            if min_distance < best_distance and min_distance <= tolerance:
-                best_distance = min_distance
-                best_face_location = location
+        # Encodings are only needed to compare against the references
+        # (a single detected face still has to pass the tolerance check)
+        face_encodings = np.asarray(_dlib_face_encodings(image, face_locations))
+        # Distances from every detected face to every reference encoding at once: (faces, references)
+        distances = np.linalg.norm(face_encodings[:, None, :] - reference_encodings[None, :, :], axis=2)
+        # Pick the face with the minimum distance to any reference encoding, if it meets tolerance
+        min_distances = distances.min(axis=1)
+        best_index = int(min_distances.argmin())
+        best_distance = min_distances[best_index]
+        if best_distance <= tolerance:
+            best_face_location = face_locations[best_index]
 
     if best_face_location is None:
         # No face matched the references within the tolerance
-        if reference_encodings:
-             print(f"  No face matched reference with tolerance {tolerance}. Smallest dist: {best_distance if best_distance != float('inf') else 'N/A'}")
+        print(f"  No face matched reference with tolerance {tolerance}. Smallest dist: {best_distance:.3f}")
         return None, None, None
 
     # Get landmarks for the selected face
-    # Use the 'large' model for potentially more accurate/stable landmarks needed for affine transform
-    landmarks_list = face_recognition.face_landmarks(image, [best_face_location], model='large')
-    if landmarks_list:
-        best_landmarks = landmarks_list[0]
+    # Use the 68-point ('large') model for more accurate/stable landmarks needed for affine transform
+    best_landmarks = _dlib_face_landmarks(image, best_face_location)
 
     return best_face_location, best_landmarks, best_distance
 
+@njit(cache=True)
+def _compute_dest_points(orig_left, orig_right, orig_nose, cx, cy, target_face_width):
+    """
+    Computes where the source eye centers and nose tip should land on the canvas.
+    The eyes are placed level, target_face_width apart and centered on (cx, cy);
+    the nose keeps its position relative to the eyes (rotated and scaled with them).
+
+    Args:
+        orig_left, orig_right, orig_nose: (x, y) source points. The eyes must not coincide.
+        cx, cy (float): Canvas anchor point for the eye midpoint.
+        target_face_width (float): Desired distance between the eyes.
+
+    Returns:
+        numpy.ndarray: 3x2 float32 array of destination points (left eye, right eye, nose tip).
+    """
+    # 1. Find midpoint between eyes in source (the destination midpoint is the anchor by definition)
+    mid_x = (orig_left[0] + orig_right[0]) / 2.0
+    mid_y = (orig_left[1] + orig_right[1]) / 2.0
+
+    # 2. Find vector between eyes in source to determine original scale and angle
+    eyes_x = orig_right[0] - orig_left[0]
+    eyes_y = orig_right[1] - orig_left[1]
+
+    # 3. Calculate the implied scale and rotation needed to map source eyes to dest eyes
+    scale = target_face_width / math.sqrt(eyes_x * eyes_x + eyes_y * eyes_y)
+    angle_rad = math.atan2(eyes_y, eyes_x) # Angle of the source eye line
+
+    # 4. Get vector from source eye midpoint to source nose tip
+    nose_x = orig_nose[0] - mid_x
+    nose_y = orig_nose[1] - mid_y
+
+    # 5. Rotate this vector by the *negative* of the source eye angle to align it relative to a horizontal baseline
+    cos_a = math.cos(-angle_rad)
+    sin_a = math.sin(-angle_rad)
+    rotated_x = nose_x * cos_a - nose_y * sin_a
+    rotated_y = nose_x * sin_a + nose_y * cos_a
+
+    # 6./7. Scale the rotated vector and add it to the destination eye midpoint to get the target nose position
+    pts_dst = np.empty((3, 2), dtype=np.float32)
+    pts_dst[0, 0] = cx - target_face_width / 2.0 # Target eye positions: centered horizontally,
+    pts_dst[0, 1] = cy                           # target_face_width apart, same Y coordinate
+    pts_dst[1, 0] = cx + target_face_width / 2.0
+    pts_dst[1, 1] = cy
+    pts_dst[2, 0] = cx + rotated_x * scale
+    pts_dst[2, 1] = cy + rotated_y * scale
+    return pts_dst
+
 # --- Main Processing Function ---
 
 def process_image_direct_affine(image_path, reference_encodings, target_face_width,
-                                final_canvas_size, anchor_point, use_cnn=False):
+                                final_canvas_size, anchor_point, detector="hog"):
     """
     Detects the target face, calculates the affine transform to align it,
-    and warps the image and an alpha mask directly onto the final canvas dimensions.
+    and warps the image and an alpha mask onto the final canvas. Only the
+    canvas region covered by the warped image (its bounding box, the "tile")
+    is materialized; the rest of the canvas is empty by definition.
 
     Args:
         image_path (str): Path to the input image.
-        reference_encodings (list): List of reference face encodings.
+        reference_encodings (numpy.ndarray): (N, 128) array of reference face encodings.
         target_face_width (int): Desired distance between eyes in the output.
         final_canvas_size (tuple): (width, height) of the output canvas.
         anchor_point (tuple): (x, y) coordinates on the canvas where the
                               face center (eye midpoint) should be placed.
-        use_cnn (bool): Whether to use the CNN face detector.
+        detector (str): Face detector to use: 'hog', 'cnn' or 'dnn'.
 
     Returns:
-        tuple: (warped_image_cv, warped_mask, status, dest_left_eye, dest_right_eye)
-               - warped_image_cv: Warped image as an OpenCV BGR numpy array.
-               - warped_mask: Warped alpha mask as a grayscale numpy array.
+        tuple: (warped_image_cv, warped_mask, tile_origin, status, dest_left_eye, dest_right_eye)
+               - warped_image_cv: Warped image tile as an OpenCV BGR numpy array.
+               - warped_mask: Warped alpha mask tile as a grayscale numpy array.
+               - tile_origin: (x, y) canvas position of the tile's top-left corner.
                - status: 'success', 'fallback_landmarks', 'error', etc.
-               - dest_left_eye, dest_right_eye: Target coordinates for eyes (for debug).
-               Returns (None, None, status, None, None) on failure.
+               - dest_left_eye, dest_right_eye: Target canvas coordinates for eyes (for debug).
+               Returns (None, None, None, status, None, None) on failure.
     """
     final_canvas_width, final_canvas_height = final_canvas_size
     warped_mask = None # Initialize mask return value
 
     # --- Load Image ---
     try:
-        image_rgb = face_recognition.load_image_file(image_path)
-        img_h, img_w, _ = image_rgb.shape
-        image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR) # OpenCV uses BGR
+        # Decode once: OpenCV's BGR for the warp, plus an RGB copy for the face models
+        image_bgr = read_image_bgr(image_path)
+        img_h, img_w, _ = image_bgr.shape
+        image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
     except Exception as e:
         print(f"Error loading image {image_path}: {e}")
-        return None, None, 'error_load', None, None
+        return None, None, None, 'error_load', None, None
 
     # --- Find Face and Landmarks ---
-    face_location, landmarks, distance = get_target_face(image_rgb, reference_encodings, use_cnn)
+    face_location, landmarks, distance = get_target_face(image_rgb, reference_encodings, detector)
 
     # Check if necessary landmarks were found
     if (face_location is None or landmarks is None or
             not landmarks.get('left_eye') or not landmarks.get('right_eye') or
             not landmarks.get('nose_bridge')): # nose_bridge is needed for the 3rd point
         print(f"  -> No matching face or required landmarks (eyes, nose_bridge) found in {os.path.basename(image_path)}. Skipping.")
-        return None, None, 'fallback_landmarks', None, None
+        return None, None, None, 'fallback_landmarks', None, None
 
     # --- Define Source Points (from detected landmarks) ---
     try:
-        left_eye_pts = np.array(landmarks['left_eye'])
-        right_eye_pts = np.array(landmarks['right_eye'])
-        nose_pts = np.array(landmarks['nose_bridge']) # Use nose_bridge group
-        # Calculate average center for eyes
-        orig_left_center = left_eye_pts.mean(axis=0)
-        orig_right_center = right_eye_pts.mean(axis=0)
-        # Use the bottom point of the nose bridge as the third stable point
-        orig_nose_tip = nose_pts[-1]
+        # Calculate average center for eyes (plain Python: 6 points each, too few for numpy to pay off)
+        left_eye_pts = landmarks['left_eye']
+        right_eye_pts = landmarks['right_eye']
+        orig_left_center = (sum(p[0] for p in left_eye_pts) / len(left_eye_pts),
+                            sum(p[1] for p in left_eye_pts) / len(left_eye_pts))
+        orig_right_center = (sum(p[0] for p in right_eye_pts) / len(right_eye_pts),
+                             sum(p[1] for p in right_eye_pts) / len(right_eye_pts))
+        # Use the bottom point of the nose bridge group as the third stable point
+        nose_x, nose_y = landmarks['nose_bridge'][-1]
+        orig_nose_tip = (float(nose_x), float(nose_y))
         # Define the 3 source points for the affine transform
         pts_src = np.float32([orig_left_center, orig_right_center, orig_nose_tip])
     except Exception as e:
         print(f"  Error processing landmarks for {os.path.basename(image_path)}: {e}")
-        return None, None, 'error_landmarks', None, None
+        return None, None, None, 'error_landmarks', None, None
 
     # --- Define Destination Points (on the final canvas) ---
-    cx, cy = anchor_point # Center of the canvas
-    # Target eye positions: centered horizontally, target_face_width apart, same Y coordinate
-    dest_left_eye = np.float32([cx - target_face_width / 2.0, cy])
-    dest_right_eye = np.float32([cx + target_face_width / 2.0, cy])
-
-    # Calculate the target nose tip position to maintain geometric proportions
-    # 1. Find midpoint between eyes in source and destination
-    eye_midpoint_src = (orig_left_center + orig_right_center) / 2.0
-    eye_midpoint_dst = anchor_point # By definition, the target eye midpoint is the anchor
-
-    # 2. Find vector between eyes in source to determine original scale and angle
-    vec_eyes_src = orig_right_center - orig_left_center
-    dist_eyes_src = np.linalg.norm(vec_eyes_src)
+    dist_eyes_src = math.hypot(orig_right_center[0] - orig_left_center[0],
+                               orig_right_center[1] - orig_left_center[1])
     if dist_eyes_src < 1e-6: # Avoid division by zero
         print(f"  Warning: Zero source eye distance in {os.path.basename(image_path)}. Skipping.")
-        return None, None, 'error_geometry', None, None
-
-    # 3. Calculate the implied scale and rotation needed to map source eyes to dest eyes
-    scale = target_face_width / dist_eyes_src
-    angle_rad = math.atan2(vec_eyes_src[1], vec_eyes_src[0]) # Angle of the source eye line
-
-    # 4. Get vector from source eye midpoint to source nose tip
-    vec_mid_to_nose_src = orig_nose_tip - eye_midpoint_src
-
-    # 5. Rotate this vector by the *negative* of the source eye angle to align it relative to a horizontal baseline
-    cos_a = math.cos(-angle_rad)
-    sin_a = math.sin(-angle_rad)
-    vec_rotated_nose = np.array([
-        vec_mid_to_nose_src[0] * cos_a - vec_mid_to_nose_src[1] * sin_a,
-        vec_mid_to_nose_src[0] * sin_a + vec_mid_to_nose_src[1] * cos_a
-    ])
-
-    # 6. Scale the rotated vector by the calculated scale factor
-    vec_nose_dst = vec_rotated_nose * scale
+        return None, None, None, 'error_geometry', None, None
 
-    # 7. Add the scaled, rotated vector to the destination eye midpoint to get the target nose position
-    dest_nose_tip = np.float32(eye_midpoint_dst + vec_nose_dst)
-
-    # Define the 3 destination points corresponding to the source points
-    pts_dst = np.float32([dest_left_eye, dest_right_eye, dest_nose_tip])
+    # Target eyes level and centered on the anchor; nose tip keeps its geometric proportions
+    cx, cy = anchor_point # Center of the canvas
+    pts_dst = _compute_dest_points(orig_left_center, orig_right_center, orig_nose_tip,
+                                   float(cx), float(cy), float(target_face_width))
+    dest_left_eye, dest_right_eye = pts_dst[0], pts_dst[1]
 
     # --- Calculate Affine Matrix and Warp Image + Mask ---
     try:
@@ -290,36 +531,263 @@ def process_image_direct_affine(image_path, reference_encodings, target_face_wid
         M = cv2.getAffineTransform(pts_src, pts_dst)
         print(f"  -> Calculated Affine Matrix M for {os.path.basename(image_path)}")
 
-        # Warp the original BGR image onto the final canvas size using the matrix
-        # INTER_CUBIC provides better quality interpolation for the image itself
+        # --- Find the Warped Image's Footprint on the Canvas ---
+        # The original image's footprint on the canvas is its rectangle transformed by M.
+        # Corners sit on the outer pixel edges (-0.5 .. size-0.5) in pixel-center coordinates.
+        corners = np.float32([[-0.5, -0.5], [img_w - 0.5, -0.5],
+                              [img_w - 0.5, img_h - 0.5], [-0.5, img_h - 0.5]])
+        canvas_corners = cv2.transform(corners.reshape(-1, 1, 2), M).reshape(-1, 2)
+        # Tight bounding box of the footprint, clipped to the canvas
+        x0 = max(int(np.floor(canvas_corners[:, 0].min())), 0)
+        y0 = max(int(np.floor(canvas_corners[:, 1].min())), 0)
+        x1 = min(int(np.ceil(canvas_corners[:, 0].max())) + 1, final_canvas_width)
+        y1 = min(int(np.ceil(canvas_corners[:, 1].max())) + 1, final_canvas_height)
+        if x1 <= x0 or y1 <= y0:
+            print(f"  Warning: Warped image falls entirely outside the canvas for {os.path.basename(image_path)}.")
+            return None, None, None, 'error_warp', None, None
+        tile_size = (x1 - x0, y1 - y0)
+
+        # Shift the transform so the tile's top-left corner maps to (0, 0)
+        M_tile = M.copy()
+        M_tile[0, 2] -= x0
+        M_tile[1, 2] -= y0
+
+        # Overall scale of the transform (the same along both axes)
+        scale = target_face_width / dist_eyes_src
+        if scale < 1.0:
+            # Downscale: box-filter the source down to ~the output scale with INTER_AREA
+            # (antialiased), then warp the smaller image with the cheaper INTER_LINEAR
+            small_w = max(int(round(img_w * scale)), 1)
+            small_h = max(int(round(img_h * scale)), 1)
+            warp_src = cv2.resize(image_bgr, (small_w, small_h), interpolation=cv2.INTER_AREA)
+            sx, sy = small_w / img_w, small_h / img_h
+            # Re-express M_tile in the resized image's coordinates:
+            # original x = (small x + 0.5) / sx - 0.5 (pixel centers), same for y
+            M_warp = M_tile.copy()
+            M_warp[:, 0] = M_tile[:, 0] / sx
+            M_warp[:, 1] = M_tile[:, 1] / sy
+            M_warp[:, 2] += M_tile[:, 0] * (0.5 / sx - 0.5) + M_tile[:, 1] * (0.5 / sy - 0.5)
+            interpolation = cv2.INTER_LINEAR
+        else:
+            # Upscale: INTER_CUBIC provides better quality interpolation for the image itself
+            warp_src, M_warp = image_bgr, M_tile
+            interpolation = cv2.INTER_CUBIC
+
+        # Warp the BGR image onto the tile using the shifted matrix
         warped_image_cv = cv2.warpAffine(
-            image_bgr, M, final_canvas_size, flags=cv2.INTER_CUBIC,
+            warp_src, M_warp, tile_size, flags=interpolation,
             borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0) # Fill empty areas with black
         )
         print(f"  -> Warped image successfully.")
 
-        # --- Create and Warp Alpha Mask ---
-        # Create a mask the same size as the *original* input image, filled with white (255)
-        orig_mask = np.ones((img_h, img_w), dtype=np.uint8) * 255
-        # Warp this white mask using the *same* affine transform M
-        # Use INTER_NEAREST to keep mask edges sharp and avoid semi-transparent pixels
-        # Fill empty areas in the warped mask with black (0) for transparency
-        warped_mask = cv2.warpAffine(
-            orig_mask, M, final_canvas_size, flags=cv2.INTER_NEAREST,
-            borderMode=cv2.BORDER_CONSTANT, borderValue=(0)
-        )
-        print(f"  -> Warped alpha mask successfully.")
+        # --- Create Alpha Mask ---
+        # Draw the footprint quadrilateral directly instead of warping a full-size white mask.
+        # Fill empty areas with black (0) for transparency; 4 fractional bits keep edges sub-pixel accurate
+        warped_mask = np.zeros((tile_size[1], tile_size[0]), dtype=np.uint8)
+        tile_corners = canvas_corners - np.float32([x0, y0])
+        cv2.fillConvexPoly(warped_mask, np.round(tile_corners * 16).astype(np.int32), 255, shift=4)
+        print(f"  -> Drew alpha mask successfully.")
 
     except Exception as e:
         print(f"  Error during Affine Transform/Warp for {os.path.basename(image_path)}: {e}")
-        return None, None, 'error_warp', None, None # Return None for image and mask
+        return None, None, None, 'error_warp', None, None # Return None for image and mask
+
+    # --- Return warped image tile (BGR), mask tile (grayscale) and tile position ---
+    return warped_image_cv, warped_mask, (x0, y0), 'success', dest_left_eye, dest_right_eye
+
+# --- Worker Process Functions ---
+
+# Default worker count limits: each worker keeps a full-size output canvas
+# (~340 MB as RGBA) plus the PNG encoder's buffers, the decoded source image
+# and its own copy of the dlib models
+MAX_DEFAULT_WORKERS = 8
+WORKER_MEMORY_BYTES = 1536 * 1024 * 1024
+
+def default_worker_count():
+    """
+    Default number of image worker processes: one per CPU core, but at most
+    MAX_DEFAULT_WORKERS and no more than half the physical memory fits at
+    WORKER_MEMORY_BYTES per worker.
+    """
+    workers = min(os.cpu_count() or 1, MAX_DEFAULT_WORKERS)
+    try:
+        total_memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        workers = min(workers, total_memory // 2 // WORKER_MEMORY_BYTES)
+    except (AttributeError, ValueError, OSError):
+        pass # Memory size not available on this platform; keep the CPU-based count
+    return max(1, workers)
+
+# Debug images show the canvas within this many pixels of the eye midpoint
+# (at least target_face_width, so large faces still fit)
+DEBUG_CROP_RADIUS = 300
+
+# Per-process state set by _init_worker: reference encodings and run options
+# (plus the reusable output canvas, created on first use by _get_canvas)
+_WORKER_STATE = {}
+
+def _init_worker(reference_encodings, options):
+    """
+    Worker process initializer. Stores the reference encodings (unpickled once
+    per worker rather than once per image) and the run options.
+    """
+    _WORKER_STATE["reference_encodings"] = reference_encodings
+    _WORKER_STATE["options"] = options
+    # Split the cores between workers so OpenCV's internal threads (warpAffine, resize) don't oversubscribe
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(options["opencv_threads"])
+    if options["detector"] == "dnn":
+        load_dnn_detector(options["dnn_model_dir"])
+
+def _get_canvas(jpg, size):
+    """
+    Returns this worker's full-size output canvas, allocating it on first use:
+    a white BGR numpy array for JPG output, a transparent RGBA PIL image for PNG.
+    The canvas is reused for every image: callers must reset the area they
+    pasted into once the image has been saved.
+    """
+    canvas = _WORKER_STATE.get("canvas")
+    if canvas is None:
+        width, height = size
+        if jpg:
+            canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+        else:
+            canvas = Image.new("RGBA", size, (0, 0, 0, 0))
+        _WORKER_STATE["canvas"] = canvas
+    return canvas
+
+def _save_debug_image(canvas, debug_path, dest_le, dest_re, radius):
+    """
+    Saves the canvas region around the target eyes (as PNG) with the eye
+    markers drawn on it. Only that small crop is copied, never the full canvas.
+    Errors are reported but not fatal, the main image is still saved.
+
+    Args:
+        canvas: The output canvas (BGR numpy array or PIL image) with the tile placed.
+        debug_path (str): Where to save the debug image.
+        dest_le, dest_re: Target canvas coordinates of the eyes.
+        radius (int): Half the side of the square crop around the eye midpoint.
+    """
+    try:
+        # Crop box centered on the eye midpoint, clipped to the canvas
+        canvas_w, canvas_h = canvas.size if isinstance(canvas, Image.Image) else canvas.shape[1::-1]
+        mid_x = int(round((dest_le[0] + dest_re[0]) / 2.0))
+        mid_y = int(round((dest_le[1] + dest_re[1]) / 2.0))
+        left, top = max(mid_x - radius, 0), max(mid_y - radius, 0)
+        right, bottom = min(mid_x + radius, canvas_w), min(mid_y + radius, canvas_h)
+        if isinstance(canvas, Image.Image):
+            debug_img_pil = canvas.crop((left, top, right, bottom))
+        else:
+            debug_img_pil = Image.fromarray(cv2.cvtColor(canvas[top:bottom, left:right], cv2.COLOR_BGR2RGB))
+
+        draw = ImageDraw.Draw(debug_img_pil)
+        # Target eye coordinates calculated earlier, relative to the crop
+        le_coords = (int(round(dest_le[0])) - left, int(round(dest_le[1])) - top)
+        re_coords = (int(round(dest_re[0])) - left, int(round(dest_re[1])) - top)
+        # Draw markers
+        draw.line([le_coords, re_coords], fill="lime", width=3) # Green line
+        radius = 5
+        draw.ellipse((le_coords[0]-radius, le_coords[1]-radius, le_coords[0]+radius, le_coords[1]+radius), outline="lime", width=2)
+        draw.ellipse((re_coords[0]-radius, re_coords[1]-radius, re_coords[0]+radius, re_coords[1]+radius), outline="lime", width=2)
+        debug_img_pil.save(debug_path)
+    except Exception as e:
+        print(f"  Error creating debug image {os.path.basename(debug_path)}: {e}")
+
+def _process_one(filename):
+    """
+    Aligns one image and saves the result (plus optional debug image).
+    Runs in a worker process using the state set by _init_worker.
+
+    Args:
+        filename (str): Image filename inside the input folder.
+
+    Returns:
+        str: 'saved', 'error_prepare', 'error_save', or the failure status
+             from process_image_direct_affine.
+    """
+    reference_encodings = _WORKER_STATE["reference_encodings"]
+    options = _WORKER_STATE["options"]
+    final_canvas_size = options["final_canvas_size"]
+    input_path = os.path.join(options["input_folder"], filename)
+    print(f"Processing {filename}...")
+
+    # Call the processing function to get the warped BGR tile, its alpha mask and canvas position
+    warped_image_cv, warped_mask, tile_origin, status, dest_le, dest_re = process_image_direct_affine(
+        input_path, reference_encodings, options["target_face_width"],
+        final_canvas_size, options["anchor_point"], options["detector"]
+    )
+
+    # If processing failed (e.g., no face, landmark error, warp error), skip this image
+    if status != 'success':
+        print(f"  -> Skipping {filename} (Status: {status})")
+        return status
+
+    x0, y0 = tile_origin
+    tile_h, tile_w = warped_image_cv.shape[:2]
+    if warped_mask is None:
+        # Fallback if mask failed (should not happen if status=='success')
+        print(f"  Warning: Mask missing for {filename} despite success status. Image will be opaque.")
+        warped_mask = np.full((tile_h, tile_w), 255, dtype=np.uint8)
+
+    basename = os.path.splitext(filename)[0]
+    ext = ".jpg" if options["jpg"] else ".png"
+    output_filename = f"aligned_{basename}{ext}"
+    output_path = os.path.join(options["processed_dir"], output_filename)
+
+    # JPG is composited onto the worker's white BGR canvas (OpenCV), PNG onto its transparent RGBA canvas (PIL)
+    canvas = _get_canvas(options["jpg"], final_canvas_size)
+    if options["jpg"]:
+        canvas_region = canvas[y0:y0 + tile_h, x0:x0 + tile_w] # View of the tile area
+    try:
+        # --- Place the Tile on the Canvas ---
+        try:
+            if options["jpg"]:
+                # The mask is binary (255 inside the image footprint, 0 outside), so
+                # compositing over white is a masked copy of the tile's pixels
+                np.copyto(canvas_region, warped_image_cv, where=warped_mask[..., None] > 0)
+            else:
+                # Build the RGBA tile in one pass: swap BGR -> RGB and attach the mask as alpha
+                rgba = np.empty((tile_h, tile_w, 4), dtype=np.uint8)
+                rgba[..., :3] = warped_image_cv[..., ::-1]
+                rgba[..., 3] = warped_mask # Set the alpha channel
+                canvas.paste(Image.fromarray(rgba, 'RGBA'), tile_origin)
+        except Exception as e:
+            print(f"  Error preparing final image for {filename}: {e}")
+            return 'error_prepare'
+
+        # --- Optional Debug Drawing ---
+        # Draw target eye markers on a crop of the final image around the face (always saved as PNG)
+        if options["debug_draw"]:
+            _save_debug_image(canvas, os.path.join(options["debug_dir"], f"debug_{basename}.png"),
+                              dest_le, dest_re, max(DEBUG_CROP_RADIUS, options["target_face_width"]))
 
-    # --- Return warped image (BGR) and warped mask (grayscale) ---
-    return warped_image_cv, warped_mask, 'success', dest_left_eye, dest_right_eye
+        # --- Save Final Image ---
+        try:
+            if options["jpg"]:
+                # Encode the BGR canvas directly with OpenCV's JPEG encoder
+                if not cv2.imwrite(output_path, canvas, [cv2.IMWRITE_JPEG_QUALITY, 95]):
+                    raise IOError("cv2.imwrite could not write the file")
+            else:
+                # Save the RGBA image as PNG
+                canvas.save(output_path)
+            print(f"Saved: {output_filename}")
+            return 'saved'
+        except Exception as e:
+            print(f"Error saving {output_path}: {e}")
+            return 'error_save'
+    finally:
+        # Reset only the tile area so the canvas is blank again for this worker's next image
+        if options["jpg"]:
+            canvas_region[...] = 255
+        else:
+            canvas.paste((0, 0, 0, 0), (x0, y0, x0 + tile_w, y0 + tile_h))
 
 # --- Main Execution Logic ---
 
 def main():
+    # Let OpenCV use every core in this process (and its SIMD-optimized code paths)
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(os.cpu_count() or 1)
+
     parser = argparse.ArgumentParser(
         description="Align faces in images using affine transformation based on landmarks.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter # Show default values in help
@@ -329,9 +797,14 @@ def main():
     parser.add_argument("--reference", type=str, required=True, help="Reference image, list, or folder path for target face")
     parser.add_argument("--target_face_width", type=int, default=200, help="Target distance between eyes in pixels (controls face scale)")
     parser.add_argument("--use_cnn", action="store_true", help="Use CNN model for face detection (slower, potentially more accurate)")
+    parser.add_argument("--use_dnn", action="store_true", help="Use OpenCV's DNN (res10 SSD) face detector (faster than HOG)")
+    parser.add_argument("--dnn_model_dir", type=str, default=os.path.dirname(os.path.abspath(__file__)),
+                        help=f"Folder containing {DNN_PROTOTXT} and {DNN_CAFFEMODEL} for --use_dnn")
     parser.add_argument("--jpg", action="store_true", help="Output JPG with white background (default: PNG with transparency)")
     parser.add_argument("--testing", action="store_true", help="Process only the first 10 images for testing")
     parser.add_argument("--debug_draw", action="store_true", help="Save debug images with target eyes marked")
+    parser.add_argument("--workers", type=int, default=default_worker_count(),
+                        help="Number of worker processes for parallel image processing (each holds a full-size canvas)")
     args = parser.parse_args()
 
     # --- Set Target Resolution ---
@@ -344,11 +817,19 @@ def main():
 
     print("Loading reference face encodings...")
     reference_encodings = load_reference_encodings(args.reference)
-    if not reference_encodings and not args.jpg: # Warn if falling back to first face without references
+    if len(reference_encodings) == 0 and not args.jpg: # Warn if falling back to first face without references
          print("Warning: No valid reference encodings loaded. Will attempt to use first face detected.")
          # Note: Fallback without references might not be consistent for match cuts.
 
-    print(f"\n--- Processing Images ({'CNN' if args.use_cnn else 'HOG'} detector) ---")
+    # --use_cnn takes precedence for highest accuracy
+    detector = "cnn" if args.use_cnn else "dnn" if args.use_dnn else "hog"
+    if detector == "dnn":
+        for model_file in (DNN_PROTOTXT, DNN_CAFFEMODEL):
+            if not os.path.isfile(os.path.join(args.dnn_model_dir, model_file)):
+                print(f"Error: DNN detector file not found: {os.path.join(args.dnn_model_dir, model_file)}")
+                return
+
+    print(f"\n--- Processing Images ({detector.upper()} detector) ---")
     try:
         # Get and sort list of image files to process
         image_files = sorted([f for f in os.listdir(args.input_folder)
@@ -382,113 +863,37 @@ def main():
                 if dir_path == processed_dir:
                     return
 
-    # --- Process Each Image ---
-    for filename in image_files:
-        input_path = os.path.join(args.input_folder, filename)
-        print(f"Processing [{count+1}/{len(image_files)}] {filename}...")
-
-        # Call the processing function to get the warped BGR image and alpha mask
-        warped_image_cv, warped_mask, status, dest_le, dest_re = process_image_direct_affine(
-            input_path, reference_encodings, args.target_face_width,
-            final_canvas_size, anchor_point, args.use_cnn
-        )
-
-        count += 1
-        # If processing failed (e.g., no face, landmark error, warp error), skip to next image
-        if status != 'success':
-            print(f"  -> Skipping {filename} (Status: {status})")
-            # Check testing limit after skipping
-            if args.testing and count >= 10:
-                print(f"\nTesting mode: Stopped after attempting {count} images.")
-                break
-            continue # Go to next file
-
-        processed_count += 1 # Increment count of successfully processed images
-
-        # --- Prepare Final PIL Image for Saving ---
-        final_pil_to_save = None # Will hold the Image object ready for saving
-        try:
-            # Create an RGBA PIL Image using the warped BGR image and the warped alpha mask
-            # This is needed as an intermediate step for both PNG and JPG output formats
-            if warped_mask is not None:
-                # Combine BGR and mask into BGRA using OpenCV
-                warped_bgra = cv2.cvtColor(warped_image_cv, cv2.COLOR_BGR2BGRA)
-                warped_bgra[:, :, 3] = warped_mask # Set the alpha channel
-                # Convert the BGRA OpenCV array to an RGBA PIL Image
-                temp_pil_rgba = Image.fromarray(cv2.cvtColor(warped_bgra, cv2.COLOR_BGRA2RGBA))
-            else:
-                # Fallback if mask failed (should not happen if status=='success')
-                print(f"  Warning: Mask missing for {filename} despite success status. Image will be opaque.")
-                temp_pil_rgba = Image.fromarray(cv2.cvtColor(warped_image_cv, cv2.COLOR_BGR2RGB)).convert('RGBA')
-
-            # Determine the final image based on the output format flag (--jpg)
-            if args.jpg:
-                # --- JPG Output: Composite onto White Background ---
-                # Create a new white RGB canvas of the final size
-                white_canvas = Image.new("RGB", final_canvas_size, (255, 255, 255))
-                # Paste the (potentially transparent) RGBA image onto the white canvas.
-                # The third argument (temp_pil_rgba) ensures PIL uses the alpha channel as the mask.
-                white_canvas.paste(temp_pil_rgba, (0, 0), temp_pil_rgba)
-                final_pil_to_save = white_canvas # This RGB image is ready for JPG saving
-            else:
-                # --- PNG Output: Use the RGBA image directly ---
-                final_pil_to_save = temp_pil_rgba # This RGBA image is ready for PNG saving
-
-        except Exception as e:
-            print(f"  Error preparing final PIL image for {filename}: {e}")
-            # If PIL preparation fails, cannot save or debug draw
-            if args.testing and count >= 10:
-                print(f"\nTesting mode: Stopped after attempting {count} images.")
-                break
-            continue # Skip to next file
-
-        # --- Optional Debug Drawing ---
-        # Draw target eye markers on the final PIL image (before saving)
-        if args.debug_draw and final_pil_to_save: # Check if image exists
-            try:
-                # Work on a copy to avoid modifying the image to be saved
-                debug_img_pil = final_pil_to_save.copy()
-                draw = ImageDraw.Draw(debug_img_pil)
-                # Target eye coordinates calculated earlier
-                le_coords = (int(round(dest_le[0])), int(round(dest_le[1])))
-                re_coords = (int(round(dest_re[0])), int(round(dest_re[1])))
-                # Draw markers
-                draw.line([le_coords, re_coords], fill="lime", width=3) # Green line
-                radius = 5
-                draw.ellipse((le_coords[0]-radius, le_coords[1]-radius, le_coords[0]+radius, le_coords[1]+radius), outline="lime", width=2)
-                draw.ellipse((re_coords[0]-radius, re_coords[1]-radius, re_coords[0]+radius, re_coords[1]+radius), outline="lime", width=2)
-
-                # Save the debug image (always as PNG for potential transparency)
-                basename = os.path.splitext(filename)[0]
-                debug_path = os.path.join(debug_dir, f"debug_{basename}.png")
-                debug_img_pil.save(debug_path)
-            except Exception as e:
-                print(f"  Error creating debug image for {filename}: {e}")
-                # Non-fatal error, continue saving the main image
-
-        # --- Save Final Image ---
-        if final_pil_to_save: # Check again if the final image was prepared successfully
-            basename = os.path.splitext(filename)[0]
-            ext = ".jpg" if args.jpg else ".png"
-            output_filename = f"aligned_{basename}{ext}"
-            output_path = os.path.join(processed_dir, output_filename)
-            try:
-                if args.jpg:
-                    # Save the RGB image (composited on white) as JPG
-                    final_pil_to_save.save(output_path, quality=95)
-                else:
-                    # Save the RGBA image as PNG
-                    final_pil_to_save.save(output_path)
-                print(f"Saved: {output_filename}")
-                saved_count += 1 # Increment count of successfully saved images
-            except Exception as e:
-                 print(f"Error saving {output_path}: {e}")
-                 # Do not increment saved_count if save fails
-
-        # Check testing limit after successful processing and saving attempt
-        if args.testing and count >= 10:
-            print(f"\nTesting mode: Stopped after attempting {count} images.")
-            break # Exit the loop
+    # --- Process Each Image (in parallel worker processes) ---
+    if args.testing:
+        image_files = image_files[:10]
+    options = {
+        "input_folder": args.input_folder,
+        "processed_dir": processed_dir,
+        "debug_dir": debug_dir,
+        "target_face_width": args.target_face_width,
+        "final_canvas_size": final_canvas_size,
+        "anchor_point": anchor_point,
+        "detector": detector,
+        "dnn_model_dir": args.dnn_model_dir,
+        "jpg": args.jpg,
+        "debug_draw": args.debug_draw,
+    }
+    num_workers = max(1, min(args.workers, len(image_files)))
+    options["opencv_threads"] = max(1, (os.cpu_count() or 1) // num_workers)
+    print(f"Using {num_workers} worker process(es)")
+    # 'spawn' keeps workers independent of the parent's dlib/CUDA state
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(reference_encodings, options)) as executor:
+        for filename, status in zip(image_files, executor.map(_process_one, image_files, chunksize=4)):
+            count += 1
+            if status in ('saved', 'error_prepare', 'error_save'):
+                processed_count += 1 # Warp succeeded
+            if status == 'saved':
+                saved_count += 1
+            print(f"[{count}/{len(image_files)}] {filename}: {status}")
+
+    if args.testing and count >= 10:
+        print(f"\nTesting mode: Stopped after attempting {count} images.")
 
     # --- Final Summary ---
     print(f"\n--- Processing Complete ---")
@@ -1,9 +1,43 @@
 import cv2
+import numpy as np
 import pytesseract
 import argparse
+import io
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
 
-def extract_text_from_video(video_path, output_path, sample_interval_sec=1):
+# Each OCR worker runs its own tesseract process; keep tesseract's OpenMP to one
+# thread so the pool (one worker per core) doesn't oversubscribe the CPU
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# Max sampled frames waiting on OCR at once (bounds memory while decode runs ahead)
+OCR_QUEUE_SIZE = 16
+# LSTM engine, assume a single uniform block of text
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+# LSTM engine, treat the image as a single text line (cheaper page layout analysis)
+TESSERACT_SINGLE_LINE_CONFIG = "--oem 1 --psm 7"
+# Subtitle region: only OCR the frame below this fraction of its height
+SUBTITLE_REGION_TOP = 0.6
+# Near-duplicate gating: frames are compared at this size, and a mean absolute
+# difference below the threshold (0-255 scale) reuses the previous OCR result
+DIFF_SIZE = (64, 36)
+DIFF_THRESHOLD = 3
+
+def _ocr_frame(png_bytes, config=TESSERACT_CONFIG):
+    # Runs in a worker process; frames arrive PNG-encoded to keep pickling cheap
+    return pytesseract.image_to_string(Image.open(io.BytesIO(png_bytes)), config=config)
+
+def write_frame_text(f, frame_count, fps, text):
+    if text.strip():
+        # Write the frame number and timestamp along with the extracted text
+        f.write(f"Frame {frame_count} (Time: {frame_count/fps:.2f} sec):\n")
+        f.write(text)
+        f.write("\n" + "="*50 + "\n")
+
+def extract_text_from_video(video_path, output_path, sample_interval_sec=1, workers=None,
+                            subtitle_region=False, single_line=False):
     # Open the video file
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
@@ -12,29 +46,56 @@ def extract_text_from_video(video_path, output_path, sample_interval_sec=1):
 
     # Get video FPS to calculate frame intervals
     fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_interval = int(fps * sample_interval_sec)
+    frame_interval = max(1, int(fps * sample_interval_sec))
     frame_count = 0
+    pending = deque() # (frame_count, future) in frame order
+    config = TESSERACT_SINGLE_LINE_CONFIG if single_line else TESSERACT_CONFIG
+    prev_small = None # Thumbnail of the last frame actually sent to OCR
+    prev_future = None
 
-    with open(output_path, 'w', encoding='utf-8') as f:
+    with open(output_path, 'w', encoding='utf-8') as f, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            # grab() only demuxes/decodes; skipped frames never get color-converted or copied out
+            if not cap.grab():
                 break
 
             # Process the frame based on sampling interval
             if frame_count % frame_interval == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+
                 # Convert frame to grayscale (improves OCR accuracy)
                 gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                
-                # Extract text from the grayscale image
-                text = pytesseract.image_to_string(gray)
-                if text.strip():
-                    # Write the frame number and timestamp along with the extracted text
-                    f.write(f"Frame {frame_count} (Time: {frame_count/fps:.2f} sec):\n")
-                    f.write(text)
-                    f.write("\n" + "="*50 + "\n")
+                # Only the bottom part of the frame when looking for subtitles (less area for Tesseract)
+                if subtitle_region:
+                    gray = gray[int(SUBTITLE_REGION_TOP * gray.shape[0]):, :]
+
+                # Overlays rarely change between samples: reuse the last OCR result if the frame looks the same
+                small = cv2.resize(gray, DIFF_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+                if prev_small is None or np.abs(small - prev_small).mean() >= DIFF_THRESHOLD:
+                    prev_small = small
+
+                    # Otsu binarization: clean black/white text for Tesseract, and a much smaller PNG to ship
+                    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+                    # Hand the frame to the OCR pool and keep decoding
+                    _, png = cv2.imencode(".png", binary)
+                    prev_future = executor.submit(_ocr_frame, png.tobytes(), config)
+                pending.append((frame_count, prev_future))
+
+                # Write out the oldest result once the queue is full
+                if len(pending) >= OCR_QUEUE_SIZE:
+                    idx, future = pending.popleft()
+                    write_frame_text(f, idx, fps, future.result())
             frame_count += 1
 
+        # Drain the remaining OCR results, still in frame order
+        while pending:
+            idx, future = pending.popleft()
+            write_frame_text(f, idx, fps, future.result())
+
     cap.release()
     print(f"Text extraction complete. Output saved to {output_path}")
 
@@ -43,6 +104,12 @@ if __name__ == "__main__":
     parser.add_argument("video_file", help="Path to the input video file (e.g., file.mp4)")
     parser.add_argument("--sample_interval", type=float, default=1,
                         help="Sampling interval in seconds (default is 1 second)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of parallel OCR processes (default: CPU count)")
+    parser.add_argument("--subtitle_region", action="store_true",
+                        help="Only OCR the bottom 40%% of each frame, where subtitles usually live")
+    parser.add_argument("--single_line", action="store_true",
+                        help="Treat the OCR region as a single line of text (faster Tesseract mode)")
     args = parser.parse_args()
 
     # Default the output file to the same name and path as the video file with a .txt extension
@@ -52,4 +119,5 @@ if __name__ == "__main__":
         print(f"Video file {args.video_file} does not exist.")
         exit(1)
 
-    extract_text_from_video(args.video_file, output_file, args.sample_interval)
\ No newline at end of file
+    extract_text_from_video(args.video_file, output_file, args.sample_interval, args.workers,
+                            args.subtitle_region, args.single_line)